@@ -1,107 +1,252 @@
 #!/usr/bin/env python3
 
 import argparse
-import base64
-import json
+import atexit
+import logging
+import logging.handlers
 import os
+import queue
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from types import MappingProxyType
 from typing import List, Optional, Set
 
-import requests
+import httpx
+import orjson
+import pybase64
+from requests_toolbelt import MultipartDecoder
 
 # Supported file extensions
-SUPPORTED_EXTENTIONS = {'.pdf', '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif'}
+SUPPORTED_EXTENSIONS = frozenset({'.pdf', '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif'})
+
+# Backwards-compatible alias for the old misspelled name
+SUPPORTED_EXTENTIONS = SUPPORTED_EXTENSIONS
+
+# Only keep specific MIME types for document formats that might need special handling
+_MIME_TYPES = MappingProxyType({
+    '.pdf': 'application/pdf',
+    '.doc': 'application/msword',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.xls': 'application/vnd.ms-excel',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+})
+
+# Generous read timeout - conversions can take a long time on big documents
+REQUEST_TIMEOUT = httpx.Timeout(600.0, connect=5.0)
+
+# Log through a queue so the upload workers never block each other on the
+# stdout lock; one listener thread does the actual writing. The bare
+# stdout StreamHandler keeps the output identical to the old print() calls.
+logger = logging.getLogger("marker_client")
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue,
+                                               logging.StreamHandler(sys.stdout))
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.setLevel(logging.INFO)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
 class DocumentProcessor:
     def __init__(self, url: str = "http://127.0.0.1:8000"):
         self.url = url.rstrip("/")
+        # One pooled client shared across documents so batch runs don't pay
+        # a new TCP/TLS handshake per file; with an HTTP/2-capable reverse
+        # proxy in front of the server, concurrent uploads are multiplexed
+        # over a single connection
+        # httpx ignores http2/limits on Client when an explicit transport is
+        # given, so they have to be configured on the transport itself
+        self.client = httpx.Client(
+            timeout=REQUEST_TIMEOUT,
+            transport=httpx.HTTPTransport(
+                retries=3,
+                http2=True,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+            ),
+        )
+
+    def close(self):
+        """Close the underlying HTTP client."""
+        self.client.close()
+
+    def __enter__(self):
+        return self
 
-    def process_document(self, file_path: Path, output_dir: Path, output_format: str = "markdown") -> bool:
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def process_document(self, file_path: Path, output_dir: Path, output_format: str = "markdown",
+                         save_response: bool = False) -> bool:
         """Process a single document file."""
-        if not file_path.exists():
-            print(f"Error: File not found - {file_path}")
+        # No exists() pre-check: files from find_documents were just listed,
+        # and a vanished file surfaces as an OSError from open below anyway
+        suffix = file_path.suffix.lower()
+        if suffix not in SUPPORTED_EXTENSIONS:
+            logger.error(f"Error: Unsupported file type - {file_path.suffix}")
             return False
 
-        if file_path.suffix.lower() not in SUPPORTED_EXTENTIONS:
-            print(f"Error: Unsupported file type - {file_path.suffix}")
+        # Get MIME type based on file extension
+        mime_type = self._get_mime_type(suffix)
+
+        try:
+            # httpx streams the multipart body straight from the open file
+            # instead of buffering it in memory; the with-block makes sure
+            # the handle is closed on the error path
+            with file_path.open("rb") as fh:
+                response = self.client.post(
+                    f"{self.url}/marker/upload",
+                    data={"output_format": output_format},
+                    files={"file": (file_path.name, fh, mime_type)},
+                )
+            response.raise_for_status()
+
+            if response.headers.get("Content-Type", "").startswith("multipart/"):
+                result, images = self._parse_multipart_response(response)
+            else:
+                # Older servers reply with JSON carrying base64-encoded images
+                result = orjson.loads(response.content)
+                images = self._decode_images(result)
+
+            return self._save_result(file_path, result, images, output_dir,
+                                     output_format, save_response)
+
+        except (OSError, httpx.HTTPError) as e:
+            logger.error(f"❌ Error processing {file_path}: {str(e)}")
             return False
 
-        # Create output directory with document name prefix
+    def process_batch(self, file_paths: List[Path], output_dir: Path,
+                      output_format: str = "markdown", save_response: bool = False) -> int:
+        """Upload a chunk of documents in one request and save results as
+        they stream back as NDJSON lines. Returns the number of successes."""
+        succeeded = 0
+        handles = []
+        try:
+            files = []
+            for file_path in file_paths:
+                fh = file_path.open("rb")
+                handles.append(fh)
+                files.append(("files", (file_path.name, fh,
+                                        self._get_mime_type(file_path.suffix.lower()))))
+
+            with self.client.stream(
+                "POST",
+                f"{self.url}/marker/upload_batch",
+                data={"output_format": output_format},
+                files=files,
+            ) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line.strip():
+                        continue
+                    result = orjson.loads(line)
+                    # Match by position in the request, not by filename -
+                    # basenames can repeat within a chunk
+                    index = result.get("index")
+                    if not isinstance(index, int) or not 0 <= index < len(file_paths):
+                        logger.error(f"❌ Unexpected result for: {result.get('filename')}")
+                        continue
+                    file_path = file_paths[index]
+                    images = self._decode_images(result)
+                    if self._save_result(file_path, result, images, output_dir,
+                                         output_format, save_response):
+                        succeeded += 1
+        except (OSError, httpx.HTTPError) as e:
+            logger.error(f"❌ Error processing batch: {str(e)}")
+        finally:
+            for fh in handles:
+                fh.close()
+        return succeeded
+
+    def _save_result(self, file_path: Path, result: dict, images: dict,
+                     output_dir: Path, output_format: str, save_response: bool) -> bool:
+        """Write the converted text, images and optional raw response."""
+        if not result.get("success"):
+            logger.error(f"❌ Error processing {file_path}: {result.get('error')}")
+            return False
+
+        # Create output directory with document name prefix; the images
+        # subdirectory is only created once a document actually has images
         doc_output_dir = output_dir / f"{file_path.stem}__md"
         doc_output_dir.mkdir(exist_ok=True, parents=True)
-        (doc_output_dir / "images").mkdir(exist_ok=True)
 
-        # Get MIME type based on file extension
-        mime_type = self._get_mime_type(file_path.suffix.lower())
+        # Save the text output with explicit UTF-8 encoding
+        output_path = doc_output_dir / f"output.{output_format}"
+        with output_path.open('w', encoding='utf-8') as f:
+            f.write(result["output"])
+        logger.info(f"✓ Text saved to: {output_path}")
 
-        # Prepare the request
-        files = {
-            "file": (file_path.name, file_path.open("rb"), mime_type)
-        }
-        data = {
-            "output_format": output_format
-        }
+        # Save images if any, writing in parallel since figure-heavy
+        # documents bottleneck on many small blocking writes
+        if images:
+            images_dir = os.path.join(doc_output_dir, "images")
+            os.makedirs(images_dir, exist_ok=True)
 
-        try:
-            response = requests.post(
-                f"{self.url}/marker/upload",
-                files=files,
-                data=data
-            )
-            response.raise_for_status()
-            result = response.json()
-
-            if not result.get("success"):
-                print(f"❌ Error processing {file_path}: {result.get('error')}")
-                return False
-
-            # Save the text output with explicit UTF-8 encoding
-            output_path = doc_output_dir / f"output.{output_format}"
-            with output_path.open('w', encoding='utf-8') as f:
-                f.write(result["output"])
-            print(f"✓ Text saved to: {output_path}")
-
-            # Save images if any
-            if result.get("images"):
-                for img_name, img_data in result["images"].items():
-                    img_path = doc_output_dir / "images" / f"{img_name}.png"
-                    img_path.write_bytes(base64.b64decode(img_data))
-                    print(f"  Image saved to: {img_path}")
-
-            # Save raw response with explicit UTF-8 encoding
+            def _write_image(item):
+                img_name, img_data = item
+                img_path = os.path.join(images_dir, img_name + ".png")
+                with open(img_path, 'wb') as img_file:
+                    img_file.write(img_data)
+                return img_path
+
+            with ThreadPoolExecutor(max_workers=8) as image_pool:
+                for img_path in image_pool.map(_write_image, images.items()):
+                    logger.info(f"  Image saved to: {img_path}")
+
+        # Save the raw response only on request - the text and images are
+        # already written separately, so this is mostly duplicate data
+        if save_response:
             response_path = doc_output_dir / "response.json"
-            with response_path.open('w', encoding='utf-8') as f:
-                json.dump(result, f, indent=2, ensure_ascii=False)
-            print(f"  Response saved to: {response_path}")
+            response_path.write_bytes(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+            logger.info(f"  Response saved to: {response_path}")
 
-            return True
+        return True
 
-        except requests.RequestException as e:
-            print(f"❌ Error processing {file_path}: {str(e)}")
-            return False
+    @staticmethod
+    def _decode_images(result: dict) -> dict:
+        """Pop base64-encoded images out of a JSON result and decode them."""
+        return {
+            name: pybase64.b64decode(data)
+            for name, data in (result.pop("images", None) or {}).items()
+        }
+
+    def _parse_multipart_response(self, response) -> tuple:
+        """Split a multipart reply into the JSON result and raw image bytes."""
+        result = {}
+        images = {}
+        decoder = MultipartDecoder(response.content,
+                                   response.headers.get("Content-Type", ""))
+        for part in decoder.parts:
+            disposition = part.headers.get(b"Content-Disposition", b"").decode()
+            if 'name="response"' in disposition:
+                result = orjson.loads(part.content)
+            elif 'filename="' in disposition:
+                filename = disposition.split('filename="', 1)[1].split('"', 1)[0]
+                images[filename] = part.content
+        return result, images
 
     def find_documents(self, directory: Path, recursive: bool = False) -> List[Path]:
         """Find all supported document files in a directory."""
-        all_files = []
-        for ext in SUPPORTED_EXTENTIONS:
-            if recursive:
-                all_files.extend(directory.rglob(f"*{ext}"))
-            else:
-                all_files.extend(directory.glob(f"*{ext}"))
+        # A single scandir/walk pass with a set lookup beats one glob pass
+        # per extension on large directory trees
+        if recursive:
+            all_files = [
+                Path(root) / name
+                for root, _, names in os.walk(directory)
+                for name in names
+                if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS
+            ]
+        else:
+            all_files = [
+                Path(entry.path)
+                for entry in os.scandir(directory)
+                if entry.is_file()
+                and os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS
+            ]
         return sorted(all_files)
 
     def _get_mime_type(self, extension: str) -> str:
         """Get the MIME type for a given file extension."""
-        # Only keep specific MIME types for document formats that might need special handling
-        mime_types = {
-            '.pdf': 'application/pdf',
-            '.doc': 'application/msword',
-            '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            '.xls': 'application/vnd.ms-excel',
-            '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        }
-        return mime_types.get(extension, 'application/octet-stream')
+        return _MIME_TYPES.get(extension, 'application/octet-stream')
 
 
 def main():
@@ -110,7 +255,7 @@ def main():
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog=f"""
 Supported file types:
-  {', '.join(sorted(SUPPORTED_EXTENTIONS))}
+  {', '.join(sorted(SUPPORTED_EXTENSIONS))}
 
 Examples:
   %(prog)s document.pdf                     # Process single document to current directory
@@ -135,39 +280,72 @@ Examples:
                        default="http://127.0.0.1:8000",
                        help="Server URL")
     
-    parser.add_argument("-f", "--format", 
+    parser.add_argument("-f", "--format",
                        dest="output_format",
                        default="markdown",
                        choices=["markdown", "json", "html"],
                        help="Output format")
 
-    args = parser.parse_args()
+    parser.add_argument("-j", "--jobs", type=int, default=4,
+                       help="Number of concurrent uploads in directory mode (default: 4)")
 
-    # Create processor instance
-    processor = DocumentProcessor(args.url)
+    parser.add_argument("-b", "--batch-size", type=int, default=0,
+                       help="Upload documents to the batch endpoint in chunks of this size "
+                            "(0 = one request per document)")
+
+    parser.add_argument("--save-response", action="store_true",
+                       help="Also save the raw server response as response.json")
+
+    args = parser.parse_args()
 
     # Ensure output directory exists
     args.output_dir.mkdir(exist_ok=True, parents=True)
-    
-    if args.input.is_file():
-        # Process single document
-        processor.process_document(args.input, args.output_dir, args.output_format)
-    
-    elif args.input.is_dir():
-        # Process directory
-        documents = processor.find_documents(args.input, args.recursive)
-        if not documents:
-            print(f"No supported document files found in {args.input}")
-            return
-
-        print(f"Found {len(documents)} document files")
-        for doc in documents:
-            print(f"\nProcessing: {doc}")
-            processor.process_document(doc, args.output_dir, args.output_format)
-    
-    else:
-        print(f"Error: Input path does not exist - {args.input}")
-        sys.exit(1)
+
+    # Create processor instance (closes the HTTP client on exit)
+    with DocumentProcessor(args.url) as processor:
+        if args.input.is_file():
+            # Process single document
+            processor.process_document(args.input, args.output_dir, args.output_format,
+                                       args.save_response)
+
+        elif args.input.is_dir():
+            # Process directory
+            documents = processor.find_documents(args.input, args.recursive)
+            if not documents:
+                logger.info(f"No supported document files found in {args.input}")
+                return
+
+            logger.info(f"Found {len(documents)} document files")
+            if args.batch_size > 0:
+                # One request per chunk amortizes the HTTP overhead; results
+                # stream back and are saved as each file finishes
+                succeeded = 0
+                for start in range(0, len(documents), args.batch_size):
+                    chunk = documents[start:start + args.batch_size]
+                    succeeded += processor.process_batch(chunk, args.output_dir,
+                                                         args.output_format,
+                                                         args.save_response)
+                logger.info(f"\nProcessed {succeeded}/{len(documents)} documents successfully")
+                return
+
+            # Uploads are independent and I/O-bound, so run them concurrently
+            succeeded = 0
+            with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+                futures = {
+                    executor.submit(processor.process_document, doc,
+                                    args.output_dir, args.output_format,
+                                    args.save_response): doc
+                    for doc in documents
+                }
+                for done, future in enumerate(as_completed(futures), 1):
+                    if future.result():
+                        succeeded += 1
+                    logger.info(f"[{done}/{len(documents)}] finished: {futures[future]}")
+            logger.info(f"\nProcessed {succeeded}/{len(documents)} documents successfully")
+
+        else:
+            logger.error(f"Error: Input path does not exist - {args.input}")
+            sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,35 +1,71 @@
-import traceback
+import aiofiles
+import asyncio
+import atexit
 import click
+import functools
+import logging
+import logging.handlers
 import os
+import queue
 import img2pdf
+import uuid
 from PIL import Image
 import uvicorn
 from pydantic import BaseModel, Field
-from starlette.responses import HTMLResponse
-import mimetypes
+from starlette.responses import HTMLResponse, Response, StreamingResponse
 from marker.config.parser import ConfigParser
 from marker.output import text_from_rendered
-import base64
+import pybase64
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from typing import Optional, Annotated
+from typing import List, Optional, Annotated
 import io
 from fastapi import FastAPI, Form, File, UploadFile
+from fastapi.responses import ORJSONResponse
 from marker.converters.pdf import PdfConverter
 from marker.models import create_model_dict
 from marker.settings import settings
 import datetime
-import json
+import orjson
 import shutil
+import tempfile
 
 app_data = {}
 
+# Log through a queue so request handlers and worker threads never block on
+# stdout; a single listener thread does the actual I/O. Guarded because the
+# module runs twice when uvicorn re-imports it by string from __main__, and
+# the logger registry is shared between both executions.
+logger = logging.getLogger("marker")
+if not logger.handlers:
+    _log_queue = queue.SimpleQueue()
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    _log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+    logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+    logger.setLevel(logging.INFO)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
 UPLOAD_DIRECTORY = "./uploads"
 DEBUG_DIRECTORY = "./debug_logs"
 os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
 os.makedirs(DEBUG_DIRECTORY, exist_ok=True)
 
-SUPPORTED_IMAGE_TYPES = {
+SUPPORTED_IMAGE_TYPES = frozenset({
     'image/jpeg', 'image/png', 'image/tiff', 'image/bmp', 'image/webp'
+})
+
+# Precomputed extension-to-MIME map for the supported image types; avoids
+# mimetypes' lazily initialized (and lock-protected) tables on every request
+_EXT_TO_MIME = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.tif': 'image/tiff',
+    '.tiff': 'image/tiff',
+    '.bmp': 'image/bmp',
+    '.webp': 'image/webp',
 }
 
 def create_debug_folder():
@@ -42,18 +78,61 @@ def create_debug_folder():
 def save_debug_info(folder: str, request_info: dict, response: dict, filepath: Optional[str] = None):
     """Save request and response information to the debug folder."""
     # Save request info
-    with open(os.path.join(folder, "request_info.json"), "w") as f:
-        json.dump(request_info, f, indent=2)
+    with open(os.path.join(folder, "request_info.json"), "wb") as f:
+        f.write(orjson.dumps(request_info, option=orjson.OPT_INDENT_2))
     
     # Save response
-    with open(os.path.join(folder, "response.json"), "w") as f:
-        json.dump(response, f, indent=2)
+    with open(os.path.join(folder, "response.json"), "wb") as f:
+        f.write(orjson.dumps(response, option=orjson.OPT_INDENT_2))
     
     # Copy the input file if it exists
     if filepath and os.path.exists(filepath):
         file_ext = os.path.splitext(filepath)[1]
         shutil.copy2(filepath, os.path.join(folder, f"input{file_ext}"))
 
+def sendfile_copy(src_file, dst_path: str):
+    """Copy an on-disk temp file to dst_path kernel-side via os.sendfile."""
+    src_file.flush()
+    src_fd = src_file.fileno()
+    size = os.fstat(src_fd).st_size
+    dst_fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    finally:
+        os.close(dst_fd)
+
+def build_multipart_response(result: dict, images: dict) -> Response:
+    """Pack the JSON result and raw image bytes into one multipart reply.
+
+    Sending images as binary parts instead of base64 strings inside the
+    JSON body skips two full encode/decode passes and ~33% of the
+    bandwidth per image.
+    """
+    boundary = uuid.uuid4().hex
+    parts = [
+        (f'--{boundary}\r\n'
+         f'Content-Disposition: form-data; name="response"\r\n'
+         f'Content-Type: application/json\r\n\r\n').encode()
+        + orjson.dumps(result) + b"\r\n"
+    ]
+    for name, data in images.items():
+        parts.append(
+            (f'--{boundary}\r\n'
+             f'Content-Disposition: form-data; name="image"; filename="{name}"\r\n'
+             f'Content-Type: application/octet-stream\r\n\r\n').encode()
+            + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return Response(
+        content=b"".join(parts),
+        media_type=f"multipart/form-data; boundary={boundary}",
+    )
+
 def convert_image_to_pdf(image_path: str) -> str:
     """Convert an image file to PDF format.
     
@@ -64,24 +143,85 @@ def convert_image_to_pdf(image_path: str) -> str:
         Path to the generated PDF file
     """
     pdf_path = os.path.splitext(image_path)[0] + '.pdf'
-    
-    # Open and convert image if needed
+
+    # Image.open is lazy, so checking the mode only reads the header
     with Image.open(image_path) as img:
-        # Convert to RGB if image is in RGBA mode
         if img.mode in ('RGBA', 'LA'):
+            # Flatten transparency onto white, then wrap the composite.
+            # getchannel copies just the alpha band, where split() would
+            # duplicate every channel of the image
             background = Image.new('RGB', img.size, 'white')
-            background.paste(img, mask=img.split()[-1])
-            img = background
-        
-        # Save as PDF
-        if img.mode not in ('RGB', 'L'):
-            img = img.convert('RGB')
-            
-        with open(pdf_path, 'wb') as f:
-            f.write(img2pdf.convert(image_path))
-    
+            background.paste(img, mask=img.getchannel('A'))
+            byte_stream = io.BytesIO()
+            background.save(byte_stream, format='JPEG', quality=92)
+            pdf_source = byte_stream.getvalue()
+        else:
+            # img2pdf embeds JPEG/PNG data without re-encoding, so the
+            # image never needs a full PIL decode
+            pdf_source = image_path
+
+    with open(pdf_path, 'wb') as f:
+        f.write(img2pdf.convert(pdf_source))
+
     return pdf_path
 
+async def save_upload(file: UploadFile) -> str:
+    """Persist an uploaded file, converting images to PDF.
+
+    Returns the path of the file to hand to the converter.
+    """
+    # Prefix with a unique token: uploads queue behind the conversion
+    # semaphore, so two in-flight requests sharing a basename would
+    # otherwise overwrite (and later delete) each other's files
+    upload_path = os.path.join(
+        UPLOAD_DIRECTORY, f"{uuid.uuid4().hex}_{file.filename}"
+    )
+    spooled = file.file
+    if (hasattr(os, "sendfile")
+            and isinstance(spooled, tempfile.SpooledTemporaryFile)
+            and spooled._rolled):
+        # Large uploads have already spilled to a temp file on disk, so
+        # copy them kernel-side instead of chunking through Python
+        await asyncio.to_thread(sendfile_copy, spooled, upload_path)
+    else:
+        # Stream the upload to disk in 1 MiB chunks so big PDFs don't get
+        # buffered entirely in RAM and the event loop stays responsive
+        async with aiofiles.open(upload_path, "wb") as upload_file:
+            while chunk := await file.read(1 << 20):
+                await upload_file.write(chunk)
+
+    # Check if the uploaded file is an image
+    mime_type = _EXT_TO_MIME.get(os.path.splitext(upload_path)[1].lower())
+    if mime_type in SUPPORTED_IMAGE_TYPES:
+        # Convert image to PDF
+        pdf_path = convert_image_to_pdf(upload_path)
+        # Clean up original image
+        os.remove(upload_path)
+        upload_path = pdf_path
+
+    return upload_path
+
+@functools.lru_cache(maxsize=32)
+def get_converter_parts(output_format: str, page_range: Optional[str],
+                        languages: Optional[str], force_ocr: bool,
+                        paginate_output: bool):
+    """Build the config dict, processor list and renderer for one option set.
+
+    Batch clients send the same options for every file, so cache the parsed
+    configuration instead of rebuilding it per request; only the thin
+    PdfConverter is constructed each time.
+    """
+    config_parser = ConfigParser({
+        "output_format": output_format,
+        "page_range": page_range,
+        "languages": languages,
+        "force_ocr": force_ocr,
+        "paginate_output": paginate_output,
+    })
+    config_dict = config_parser.generate_config_dict()
+    config_dict["pdftext_workers"] = 1
+    return config_dict, config_parser.get_processors(), config_parser.get_renderer()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     app_data["models"] = create_model_dict()
@@ -93,6 +233,7 @@ def create_app(root_path: str = "", debug: bool = False) -> FastAPI:
     app = FastAPI(
         lifespan=lifespan,
         root_path=root_path,
+        default_response_class=ORJSONResponse,
     )
 
     @app.get("/")
@@ -136,25 +277,61 @@ def create_app(root_path: str = "", debug: bool = False) -> FastAPI:
             Field(description="The format to output the text in. Can be 'markdown', 'json', or 'html'. Defaults to 'markdown'.")
         ] = "markdown"
 
+    # One conversion at a time - there is a single GPU - but run it in a
+    # worker thread so the event loop stays responsive for other requests
+    conversion_lock = asyncio.Semaphore(1)
+
+    def _run_conversion(params: CommonParams):
+        """Run the synchronous marker conversion; called from a worker thread."""
+        options = params.model_dump()
+        logger.debug("conversion options: %s", options)
+        config_dict, processors, renderer = get_converter_parts(
+            params.output_format,
+            params.page_range,
+            params.languages,
+            params.force_ocr,
+            params.paginate_output,
+        )
+        converter = PdfConverter(
+            config=config_dict,
+            artifact_dict=app_data["models"],
+            processor_list=processors,
+            renderer=renderer
+        )
+        rendered = converter(params.filepath)
+        text, _, images = text_from_rendered(rendered)
+
+        # Keep images as raw bytes here; each route decides how to ship them
+        def _encode_image(img):
+            byte_stream = io.BytesIO()
+            if settings.OUTPUT_IMAGE_FORMAT == "PNG":
+                # compress_level=1 encodes several times faster than the
+                # zlib default (6) for only ~15% larger files
+                img.save(byte_stream, format="PNG",
+                         compress_level=1, optimize=False)
+            else:
+                img.save(byte_stream, format=settings.OUTPUT_IMAGE_FORMAT)
+            return byte_stream.getvalue()
+
+        image_bytes = {}
+        if images:
+            # PIL releases the GIL inside the encoder, so threads scale
+            with ThreadPoolExecutor(max_workers=8) as encode_pool:
+                image_bytes = dict(
+                    zip(images.keys(), encode_pool.map(_encode_image, images.values()))
+                )
+
+        return text, rendered.metadata, image_bytes
+
     async def _convert_pdf(params: CommonParams, debug_folder: Optional[str] = None):
         assert params.output_format in ["markdown", "json", "html"], "Invalid output format"
         try:
-            options = params.model_dump()
-            print(options)
-            config_parser = ConfigParser(options)
-            config_dict = config_parser.generate_config_dict()
-            config_dict["pdftext_workers"] = 1
-            converter = PdfConverter(
-                config=config_dict,
-                artifact_dict=app_data["models"],
-                processor_list=config_parser.get_processors(),
-                renderer=config_parser.get_renderer()
-            )
-            rendered = converter(params.filepath)
-            text, _, images = text_from_rendered(rendered)
-            metadata = rendered.metadata
+            async with conversion_lock:
+                text, metadata, image_bytes = await asyncio.to_thread(
+                    _run_conversion, params
+                )
         except Exception as e:
-            traceback.print_exc()
+            logger.exception("Conversion failed for %s", params.filepath)
             response = {
                 "success": False,
                 "error": str(e),
@@ -166,18 +343,11 @@ def create_app(root_path: str = "", debug: bool = False) -> FastAPI:
                     response,
                     params.filepath
                 )
-            return response
-
-        encoded = {}
-        for k, v in images.items():
-            byte_stream = io.BytesIO()
-            v.save(byte_stream, format=settings.OUTPUT_IMAGE_FORMAT)
-            encoded[k] = base64.b64encode(byte_stream.getvalue()).decode(settings.OUTPUT_ENCODING)
+            return response, {}
 
         response = {
             "format": params.output_format,
             "output": text,
-            "images": encoded,
             "metadata": metadata,
             "success": True,
         }
@@ -190,12 +360,19 @@ def create_app(root_path: str = "", debug: bool = False) -> FastAPI:
                 params.filepath
             )
 
-        return response
+        return response, image_bytes
 
     @app.post("/marker")
     async def convert_pdf(params: CommonParams):
         debug_folder = create_debug_folder() if debug else None
-        return await _convert_pdf(params, debug_folder)
+        response, image_bytes = await _convert_pdf(params, debug_folder)
+        if response.get("success"):
+            # This route keeps the original JSON contract with base64 images
+            response["images"] = {
+                k: pybase64.b64encode(v).decode(settings.OUTPUT_ENCODING)
+                for k, v in image_bytes.items()
+            }
+        return response
 
     @app.post("/marker/upload")
     async def convert_pdf_upload(
@@ -210,20 +387,8 @@ def create_app(root_path: str = "", debug: bool = False) -> FastAPI:
         ),
     ):
         debug_folder = create_debug_folder() if debug else None
-        
-        upload_path = os.path.join(UPLOAD_DIRECTORY, file.filename)
-        with open(upload_path, "wb+") as upload_file:
-            file_contents = await file.read()
-            upload_file.write(file_contents)
-
-        # Check if the uploaded file is an image
-        mime_type, _ = mimetypes.guess_type(upload_path)
-        if mime_type in SUPPORTED_IMAGE_TYPES:
-            # Convert image to PDF
-            pdf_path = convert_image_to_pdf(upload_path)
-            # Clean up original image
-            os.remove(upload_path)
-            upload_path = pdf_path
+
+        upload_path = await save_upload(file)
 
         params = CommonParams(
             filepath=upload_path,
@@ -234,23 +399,81 @@ def create_app(root_path: str = "", debug: bool = False) -> FastAPI:
             output_format=output_format,
         )
         
-        results = await _convert_pdf(params, debug_folder)
+        results, image_bytes = await _convert_pdf(params, debug_folder)
         os.remove(upload_path)
-        return results
+        if not results.get("success"):
+            return results
+        return build_multipart_response(results, image_bytes)
+
+    @app.post("/marker/upload_batch")
+    async def convert_pdf_upload_batch(
+        page_range: Optional[str] = Form(default=None),
+        languages: Optional[str] = Form(default=None),
+        force_ocr: Optional[bool] = Form(default=False),
+        paginate_output: Optional[bool] = Form(default=False),
+        output_format: Optional[str] = Form(default="markdown"),
+        files: List[UploadFile] = File(
+            ..., description="The PDF or image files to convert."
+        ),
+    ):
+        # Persist everything up front so results can stream back while the
+        # remaining files are still converting
+        upload_paths = [(file.filename, await save_upload(file)) for file in files]
+
+        async def stream_results():
+            # Results carry the file's position in the request so clients can
+            # match them up even when basenames repeat within a chunk
+            for index, (filename, upload_path) in enumerate(upload_paths):
+                debug_folder = create_debug_folder() if debug else None
+                params = CommonParams(
+                    filepath=upload_path,
+                    page_range=page_range,
+                    languages=languages,
+                    force_ocr=force_ocr,
+                    paginate_output=paginate_output,
+                    output_format=output_format,
+                )
+                result, image_bytes = await _convert_pdf(params, debug_folder)
+                os.remove(upload_path)
+                result["index"] = index
+                result["filename"] = filename
+                if result.get("success"):
+                    result["images"] = {
+                        k: pybase64.b64encode(v).decode(settings.OUTPUT_ENCODING)
+                        for k, v in image_bytes.items()
+                    }
+                yield orjson.dumps(result) + b"\n"
+
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
 
     return app
 
+def app_factory() -> FastAPI:
+    """Build the app from environment variables; uvicorn worker processes
+    import the app by string, so the CLI options are handed over this way."""
+    return create_app(
+        os.environ.get("MARKER_ROOT_PATH", ""),
+        os.environ.get("MARKER_DEBUG") == "1",
+    )
+
 @click.command()
 @click.option("--port", type=int, default=8000, help="Port to run the server on")
 @click.option("--host", type=str, default="127.0.0.1", help="Host to run the server on")
 @click.option("--root-path", type=str, default="", help="Root path for the application (e.g., /api/marker)")
 @click.option("--debug", is_flag=True, help="Enable debug mode to save all requests and responses")
-def main(port: int, host: str, root_path: str, debug: bool):
-    app = create_app(root_path, debug)
+@click.option("--workers", type=int, default=1,
+              help="Number of uvicorn worker processes. Each worker loads its own copy of the models, so keep this at 1 unless there is GPU memory to spare.")
+def main(port: int, host: str, root_path: str, debug: bool, workers: int):
+    os.environ["MARKER_ROOT_PATH"] = root_path
+    os.environ["MARKER_DEBUG"] = "1" if debug else "0"
     uvicorn.run(
-        app,
+        "marker_server:app_factory",
+        factory=True,
         host=host,
         port=port,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
     )
 
 if __name__ == "__main__":